@@ -3,3 +3,6 @@ from .interface import *
 from .assembly import *
 from .data import *
 from .errors import *
+from .link import *
+from .snapshot import *
+from .fleet import *
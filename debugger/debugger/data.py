@@ -3,8 +3,11 @@ Module containing helper functions to deal with data exchanged with the
 on-chip debugger over the serial connection.
 """
 
+import sys
+import array
 import struct
 from enum import Enum
+from functools import lru_cache
 
 
 class DataType(Enum):
@@ -16,6 +19,31 @@ class DataType(Enum):
     BYTE = 'B',
     SIGNED_BYTE = 'b'
 
+    @property
+    def format_char(self):
+        """The struct/array format character associated with this type"""
+        return self.value[0]
+
+    @property
+    def size(self):
+        """Size of a single value of this type, in bytes"""
+        return _get_struct(self.format_char).size
+
+    @property
+    def signed(self):
+        """Whether values of this type are signed"""
+        return self.format_char.islower()
+
+
+@lru_cache(maxsize=None)
+def _get_struct(format_string):
+    """
+    Retrieve precompiled big-endian struct object for given format string.
+    :param format_string: Format string without byte order prefix
+    :return: Compiled struct.Struct instance
+    """
+    return struct.Struct(f">{format_string}")
+
 
 def deserialize_integer(buffer, data_type=DataType.WORD):
     """
@@ -24,7 +52,7 @@ def deserialize_integer(buffer, data_type=DataType.WORD):
     :param data_type: Type of integer to deserialize
     :return: Deserialized integer
     """
-    return struct.unpack(f">{data_type.value[0]}", buffer)[0]
+    return _get_struct(data_type.format_char).unpack(buffer)[0]
 
 
 def serialize_integers(data_type=DataType.WORD, amount=1, *args):
@@ -34,7 +62,7 @@ def serialize_integers(data_type=DataType.WORD, amount=1, *args):
     :param amount: Number of integers to serialize
     :return: Byte array containing raw binary representation of given integers
     """
-    return struct.pack(f">{data_type.value[0] * amount}", *args)
+    return _get_struct(data_type.format_char * amount).pack(*args)
 
 
 def serialize_integer(value, data_type=DataType.WORD):
@@ -44,5 +72,80 @@ def serialize_integer(value, data_type=DataType.WORD):
     :param value: Value to serialize
     :return: Byte array containing raw binary representation of given integer
     """
-    return struct.pack(f">{data_type.value[0]}", value)
+    return _get_struct(data_type.format_char).pack(value)
+
+
+def words_to_memory_image(buffer):
+    """
+    Convert a buffer of words as received from the on-chip debugger (big-endian, one word after
+    another) into the little-endian byte layout they have in target memory. The conversion is done
+    in-place for the whole block at once.
+
+    :param buffer: Bytearray containing raw memory read payloads. Length has to be a multiple of 4.
+    :return: The given bytearray, now containing the memory image
+    """
+    if (len(buffer) % 4) != 0:
+        raise ValueError("Word buffer length not multiple of 4 bytes")
+
+    # Payloads are big-endian and the target is little-endian, so the bytes of every word have to be
+    # reversed regardless of the host byte order. Swapping the outer and inner byte columns via extended
+    # slices does this directly in the buffer.
+    buffer[0::4], buffer[3::4] = buffer[3::4], buffer[0::4]
+    buffer[1::4], buffer[2::4] = buffer[2::4], buffer[1::4]
+    return buffer
+
+
+def view_memory_image(image, data_type=DataType.WORD):
+    """
+    Interpret given little-endian memory image as a sequence of integers of given type.
+    On little-endian hosts this does not copy any data.
+
+    :param image: Buffer containing the memory image, as returned by words_to_memory_image
+    :param data_type: Type of the integers contained in the image
+    :return: Sequence of integers, either a memoryview or an array.array
+    """
+    if (len(image) % data_type.size) != 0:
+        raise ValueError(f"Memory image length not multiple of {data_type.size} bytes")
+
+    # Native views can only be used if the native item size matches the target type
+    if sys.byteorder == 'little':
+        view = memoryview(image).cast(data_type.format_char)
+        if view.itemsize == data_type.size:
+            return view
+
+    values = array.array(data_type.format_char)
+    if values.itemsize != data_type.size:
+        return list(struct.unpack(f"<{len(image) // data_type.size}{data_type.format_char}", image))
+
+    values.frombytes(image)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def format_memory_dump(start_address, values, data_type=DataType.WORD, per_line=None):
+    """
+    Format given memory values as multi-line dump, each line prefixed with the address of
+    its first value.
+
+    :param start_address: Address of the first value
+    :param values: Sequence of integers of given type
+    :param data_type: Type of the given values
+    :param per_line: Number of values per line. Defaults to 16 bytes worth of values.
+    :return: Formatted dump as string
+    """
+    if per_line is None:
+        per_line = 16 // data_type.size
+
+    digits = data_type.size * 2
+    lines = []
+
+    for index in range(0, len(values), per_line):
+        if data_type.signed:
+            formatted = [str(value) for value in values[index:index+per_line]]
+        else:
+            formatted = [f"0x{format(value, f'0{digits}x')}" for value in values[index:index+per_line]]
+
+        lines.append(f"0x{format(start_address + index*data_type.size, '08x')}: {' '.join(formatted)}")
 
+    return "\n".join(lines)
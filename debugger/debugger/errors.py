@@ -25,3 +25,12 @@ class MemoryAddressError(DebuggerError):
     """Raised when supplied with invalid memory address, for example misaligned access"""
     pass
 
+
+class ProtocolError(DebuggerConnectionError):
+    """Raised when a response from the on-chip debugger was lost or malformed and the link had to be resynchronized"""
+    pass
+
+
+class SnapshotError(DebuggerError):
+    """Raised when a memory snapshot can't be stored, loaded or compared"""
+    pass
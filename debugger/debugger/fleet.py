@@ -0,0 +1,127 @@
+"""
+Module providing fleet operations, allowing to control many boards, each with its own on-chip
+debugger, in parallel.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .interface import *
+
+
+BoardResult = namedtuple('BoardResult', ['port', 'value', 'error'])
+BoardResult.__doc__ = """Result of an operation on a single board. Exactly one of value and error is meaningful."""
+
+
+class Fleet:
+    """
+    Manages a set of debugger interfaces, one per board, and performs operations on all of them
+    concurrently. Since communication is dominated by waiting for the serial links, a batch over many
+    boards takes about as long as on the slowest board. A failing board never affects the others.
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        Create new, empty fleet.
+        :param max_workers: Maximum number of boards to communicate with at once. Defaults to all of them.
+        """
+        self._interfaces = {}
+        self._max_workers = max_workers
+
+    @property
+    def ports(self):
+        return list(self._interfaces)
+
+    def interface(self, port):
+        """Retrieve the debugger interface of the board connected via given port"""
+        return self._interfaces[port]
+
+    def connect(self, ports, busy_ports=(), **kwargs):
+        """
+        Connect to the boards on all given ports. Boards that fail to connect are not added to the fleet.
+        Ports already in the fleet or in given busy ports are rejected, since only one interface may use a port.
+
+        :param ports: Serial ports to use
+        :param busy_ports: Ports that are used elsewhere, for example by a single-board connection
+        :param kwargs: Further arguments passed on to DebuggerInterface.connect
+        :return: Dictionary mapping each port to its BoardResult
+        """
+        results = {}
+        interfaces = {}
+
+        for port in ports:
+            if port in self._interfaces or port in busy_ports:
+                results[port] = BoardResult(port, None, DebuggerStateError(f"Port {port} is already in use"))
+            else:
+                interfaces[port] = DebuggerInterface()
+
+        results.update(self._run(interfaces, lambda port, interface: interface.connect(port, **kwargs)))
+
+        for port, result in results.items():
+            if result.error is None:
+                self._interfaces[port] = interfaces[port]
+
+        return results
+
+    def disconnect(self):
+        """Disconnect from all boards and empty the fleet"""
+        results = self.run(lambda interface: interface.disconnect())
+        self._interfaces = {}
+        return results
+
+    def run(self, operation, *args, ports=None):
+        """
+        Perform given operation on the boards in parallel.
+
+        :param operation: Callable receiving the debugger interface of a board, followed by given arguments
+        :param args: Additional arguments for the operation
+        :param ports: Ports of the boards to use. Defaults to the whole fleet.
+        :return: Dictionary mapping each port to its BoardResult
+        """
+        if ports is None:
+            ports = self._interfaces
+
+        interfaces = {port: self._interfaces[port] for port in ports}
+        return self._run(interfaces, lambda port, interface: operation(interface, *args))
+
+    def halt(self, ports=None):
+        """Halt CPU execution on all boards"""
+        return self.run(lambda interface: interface.halt(), ports=ports)
+
+    def resume(self, ports=None):
+        """Resume CPU execution on all boards"""
+        return self.run(lambda interface: interface.resume(), ports=ports)
+
+    def refresh_state(self, ports=None):
+        """Re-query the on-chip debugger state of all boards and return it"""
+        def refresh(interface):
+            interface.refresh_state()
+            return interface.state
+
+        return self.run(refresh, ports=ports)
+
+    def read_memory(self, address, count=1, data_type=DataType.WORD, ports=None):
+        """Read given number of values of given type from the memory of all boards"""
+        return self.run(lambda interface: list(interface.read_memory_typed(address, count, data_type)), ports=ports)
+
+    def write_memory(self, address, value, ports=None):
+        """Write word to given memory address on all boards"""
+        return self.run(lambda interface: interface.write_memory(address, value), ports=ports)
+
+    def verify_firmware(self, image, ports=None):
+        """Compare the flash contents of all boards with given firmware image"""
+        return self.run(lambda interface: interface.verify_firmware(image), ports=ports)
+
+    def _run(self, interfaces, operation):
+        """Run given operation, receiving port and interface, for each board in the thread pool"""
+        if not interfaces:
+            return {}
+
+        def execute(port):
+            # Every board is isolated from the others, so any failure only ends up in its own result
+            try:
+                return BoardResult(port, operation(port, interfaces[port]), None)
+            except Exception as error:
+                return BoardResult(port, None, error)
+
+        with ThreadPoolExecutor(max_workers=self._max_workers or len(interfaces)) as executor:
+            return dict(zip(interfaces, executor.map(execute, interfaces)))
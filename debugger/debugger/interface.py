@@ -3,9 +3,19 @@ Module providing primitives for communicating with the on-chip debugger over
 a serial connection, like sending and receiving memory words.
 """
 
+import time
 import serial
 from .errors import *
 from .data import *
+from .link import *
+
+
+# Baud rate the on-chip debugger UART is configured for
+DEFAULT_BAUD_RATE = 9600
+
+# Idempotent commands: sending them again after their response was lost leaves the on-chip
+# debugger in the same state as sending them once
+_RETRYABLE_COMMANDS = {b'+ST', b'+PC', b'+MR', b'+MW', b'+BP', b'+BC', b'+HL'}
 
 
 class DebuggerState(Enum):
@@ -24,6 +34,8 @@ class DebuggerInterface:
     def __init__(self):
         self._state = DebuggerState.DISCONNECTED
         self._serial = None
+        self._link = None
+        self._breakpoint = None
         self._show_responses = False
         self._port = ''
 
@@ -35,6 +47,16 @@ class DebuggerInterface:
     def port(self):
         return self._port
 
+    @property
+    def breakpoint(self):
+        """Flash address of the hardware breakpoint set via this interface, or None if there is none"""
+        return self._breakpoint
+
+    @property
+    def resync_count(self):
+        """Number of times the serial link had to be resynchronized since connecting"""
+        return self._link.resync_count if self._link is not None else 0
+
     @property
     def show_responses(self):
         return self._show_responses
@@ -52,10 +74,12 @@ class DebuggerInterface:
 
         command = b'+BP' + serialize_integer(address, DataType.WORD)
         self.send_command(command, 2)
+        self._breakpoint = address
 
     def clear_breakpoint(self):
         """Clear hardware breakpoint."""
         self.send_command(b'+BC', 2)
+        self._breakpoint = None
 
     def send_command(self, contents, response_size):
         """
@@ -68,15 +92,22 @@ class DebuggerInterface:
         if len(contents) < 3:
             raise RejectedCommandError("Command contents length has to be at least 3")
 
-        self._serial.write(contents)
-        response = self._serial.read(response_size)
+        # Idempotent commands are simply retried once after the link got resynchronized
+        attempts = 2 if contents[:3] in _RETRYABLE_COMMANDS else 1
+        for attempt in range(attempts):
+            try:
+                response = self._link.transceive(contents, response_size)
+                break
+            except ProtocolError:
+                if attempt == attempts - 1:
+                    raise
 
         # Print response contents to stdout if requested by the user.
         if self._show_responses:
             print(f"Response contents: {response}")
 
         # Check if command was accepted
-        if response.startswith(b'OK'):
+        if response.startswith(STATUS_ACCEPTED):
             return response[2:]
         else:
             raise RejectedCommandError(f"On-chip debugger rejected command \"{contents[:3].decode('utf-8')}\"")
@@ -99,6 +130,44 @@ class DebuggerInterface:
         else:
             raise DebuggerError("Received invalid on-chip debugger state response")
 
+    def wait_for_halt(self, timeout=None, cancel=None, min_interval=0.005, max_interval=0.25):
+        """
+        Wait for the CPU to halt, for example because it hit the hardware breakpoint. The state is polled
+        with exponential backoff, so targets running for a long time only cause little traffic on the link.
+
+        :param timeout: Maximum time to wait, in seconds. Wait forever if None.
+        :param cancel: Optional threading.Event that stops waiting when set
+        :param min_interval: Initial delay between two state queries, in seconds
+        :param max_interval: Maximum delay between two state queries, in seconds
+        :return: True if the CPU halted, False if waiting timed out or was cancelled
+        """
+        if self._state == DebuggerState.DISCONNECTED:
+            raise DebuggerStateError("Can't wait for halt, debugger is disconnected")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = min_interval
+
+        while True:
+            self.refresh_state()
+            if self._state == DebuggerState.HALTED:
+                return True
+
+            # Never sleep past the deadline
+            delay = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+
+            if cancel is not None:
+                if cancel.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+            interval = min(interval * 2, max_interval)
+
     def step(self):
         """Perform a single execution step."""
         if self._state != DebuggerState.HALTED:
@@ -111,41 +180,48 @@ class DebuggerInterface:
         result = self.send_command(b'+PC', 6)
         return deserialize_integer(result, DataType.WORD)
 
-    def connect(self, port):
-        """Connect to on-chip debugger using given serial port."""
+    def connect(self, port, baud_rate=DEFAULT_BAUD_RATE, latency=DEFAULT_LATENCY, resync_handler=None):
+        """
+        Connect to on-chip debugger using given serial port.
+
+        :param port: Serial port to use
+        :param baud_rate: Baud rate of the serial connection
+        :param latency: Delay, in seconds, the serial adapter adds to responses. Added to every response timeout.
+        :param resync_handler: Optional callable receiving a ResyncEvent each time the link is resynchronized
+        """
         if self._state != DebuggerState.DISCONNECTED:
             raise DebuggerStateError("Can't connect: Already connected")
 
         # Try to establish serial connection
         try:
-            self._serial = serial.Serial(port, 9600, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE, timeout=1)
+            self._serial = serial.Serial(port, baud_rate, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE, timeout=1)
             self._port = port
         except serial.SerialException:
             raise DebuggerConnectionError("Failed to connect to on-chip debugger")
 
-        # We now have to retrieve the current state of the on-chip debugger.
-        # For some reason, this can take up to five tries to succeed.
-        success = False
-        for _ in range(5):
-            try:
-                self._state = self.retrieve_state()
-                success = True
-                break
-            except DebuggerError:
-                # Ignore any debugger errors and just retry
-                pass
+        self._link = SerialLink(self._serial, baud_rate, latency)
+        self._link.resync_handler = resync_handler
 
-        # If we didn't manage to retrieve the current state in the 5 tries,
-        # something is very wrong.
-        if not success:
+        # The on-chip debugger might still be in the middle of a command, or the adapter might
+        # have buffered garbage from before the port was opened. Bring the link in sync
+        # before retrieving the current state. This is only reported if the link actually was out of sync.
+        try:
+            self._link.resync("connecting", report_clean=False)
+            self._state = self.retrieve_state()
+        except DebuggerError:
             self._serial.close()
             self._serial = None
+            self._link = None
             raise DebuggerConnectionError("Could not retrieve current debugger state")
 
     def disconnect(self):
         """Disconnect from the on-chip debugger"""
         if self._state != DebuggerState.DISCONNECTED:
             self._serial.close()
+            self._serial = None
+            self._link = None
+            self._breakpoint = None
+            self._state = DebuggerState.DISCONNECTED
         else:
             raise DebuggerStateError("Can't disconnect: Not connected")
 
@@ -210,13 +286,14 @@ class DebuggerInterface:
         command = b'+MW' + serialize_integers(DataType.WORD, 2, address, value)
         response = self.send_command(command, 2)
 
-    def read_memory_block(self, start_address, length):
+    def read_memory_raw(self, start_address, length):
         """
-        Read a block of memory of given length and beginning at given start address.
+        Read a block of memory of given length and beginning at given start address, and return it
+        as raw memory image. The payloads of all memory read responses are collected into a single buffer.
 
         :param start_address: Address to start reading from. Has to be word-aligned.
         :param length: Length of memory block, in bytes. Has to be a multiple of 4 bytes.
-        :return: List containing memory block words.
+        :return: Bytearray containing the memory block in target (little-endian) byte order.
         """
 
         # A zero-length read doesn't make sense
@@ -230,4 +307,63 @@ class DebuggerInterface:
         if (length % 4) != 0:
             raise MemoryAddressError("Memory block read length not multiple of 4 bytes")
 
-        return [self.read_memory(start_address + offset*4) for offset in range(length//4)]
+        buffer = bytearray()
+        for address in range(start_address, start_address + length, 4):
+            command = b'+MR' + serialize_integer(address, DataType.WORD)
+            buffer += self.send_command(command, 6)
+
+        # Endianness is dealt with once for the whole block
+        return words_to_memory_image(buffer)
+
+    def read_memory_typed(self, address, count, data_type=DataType.WORD):
+        """
+        Read given number of consecutive values of given type from memory. Since the on-chip
+        debugger only supports word reads, all words covering the requested range are read.
+
+        :param address: Address of the first value. Has to be aligned to the size of the data type.
+        :param count: Number of values to read
+        :param data_type: Type of the values to read
+        :return: Sequence of integers, either a memoryview or an array.array
+        """
+
+        if count <= 0:
+            raise MemoryAddressError("Memory read count has to be positive")
+
+        if (address % data_type.size) != 0:
+            raise MemoryAddressError(f"Memory read address needs to be aligned on {data_type.size} byte boundary")
+
+        # Determine word-aligned range covering the requested values
+        end_address = address + count * data_type.size
+        start_word = address - (address % 4)
+        end_word = (end_address + 3) - ((end_address + 3) % 4)
+
+        image = self.read_memory_raw(start_word, end_word - start_word)
+
+        # Only hand out the requested part of the image, without copying it
+        offset = address - start_word
+        return view_memory_image(memoryview(image)[offset:offset + count * data_type.size], data_type)
+
+    def read_memory_block(self, start_address, length):
+        """
+        Read a block of memory of given length and beginning at given start address.
+
+        :param start_address: Address to start reading from. Has to be word-aligned.
+        :param length: Length of memory block, in bytes. Has to be a multiple of 4 bytes.
+        :return: Sequence containing memory block words.
+        """
+        return view_memory_image(self.read_memory_raw(start_address, length), DataType.WORD)
+
+    def verify_firmware(self, image, base_address=0):
+        """
+        Compare the flash contents with given firmware image, as produced by objcopy.
+
+        :param image: Byte array containing the raw firmware image
+        :param base_address: Flash address the image is located at. Has to be word-aligned.
+        :return: List of addresses of all mismatching words. Empty if the flash matches the image.
+        """
+        # The flash is read in whole words, so the last word might contain bytes beyond the image.
+        length = (len(image) + 3) - ((len(image) + 3) % 4)
+        flash = self.read_memory_raw(base_address, length)
+
+        return [base_address + offset for offset in range(0, len(image), 4)
+                if flash[offset:offset+4][:len(image) - offset] != image[offset:offset+4]]
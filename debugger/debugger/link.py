@@ -0,0 +1,174 @@
+"""
+Module implementing the framed receive layer used to exchange commands and responses with the
+on-chip debugger. It detects lost or stray bytes and brings the connection back in sync.
+"""
+
+from collections import namedtuple
+from .errors import *
+
+
+# Bits transferred on the wire per byte: start bit, eight data bits and one stop bit
+BITS_PER_BYTE = 10
+
+# All responses begin with one of these status indicators
+STATUS_ACCEPTED = b'OK'
+STATUS_REJECTED = b'NO'
+
+# Command used to probe the on-chip debugger while resynchronizing. It is harmless in every
+# state and always answered with a fixed-size response.
+PROBE_COMMAND = b'+ST'
+PROBE_RESPONSES = {b'OKH', b'OKR'}
+PROBE_RESPONSE_SIZE = 3
+
+# Constant delay, in seconds, added to every timeout. USB-UART adapters commonly buffer incoming
+# data for up to 16 ms before passing it on to the host.
+DEFAULT_LATENCY = 0.05
+
+
+ResyncEvent = namedtuple('ResyncEvent', ['reason', 'discarded', 'probes'])
+ResyncEvent.__doc__ = """Describes a single resynchronization of the serial link"""
+
+
+class SerialLink:
+    """
+    Framed command/response layer on top of a serial connection. Response timeouts are derived
+    from the baud rate and the expected response size, and the link is resynchronized as soon as
+    a response is missing or malformed.
+    """
+
+    def __init__(self, connection, baud_rate, latency=DEFAULT_LATENCY, max_probes=5):
+        """
+        Create new serial link.
+        :param connection: Open serial connection
+        :param baud_rate: Baud rate used by the serial connection
+        :param latency: Constant delay, in seconds, added to every timeout to account for the serial adapter
+        :param max_probes: Maximum number of probe commands sent during a single resynchronization
+        """
+        self._connection = connection
+        self._baud_rate = baud_rate
+        self._latency = latency
+        self._max_probes = max_probes
+        self._resync_count = 0
+        self.resync_handler = None
+
+    @property
+    def resync_count(self):
+        return self._resync_count
+
+    def timeout_for(self, size):
+        """
+        Determine the time to wait for given amount of bytes. This allows for twice the pure
+        transmission time plus the adapter latency.
+        :param size: Number of bytes expected
+        :return: Timeout in seconds
+        """
+        return 2 * size * BITS_PER_BYTE / self._baud_rate + self._latency
+
+    def transceive(self, contents, response_size):
+        """
+        Send a command and receive its response frame.
+
+        :param contents: A byte array containing the full command
+        :param response_size: The expected response size, in bytes and including the status indicator (OK/NO)
+        :return: Full response including status indicator. Rejections are always two bytes long.
+        """
+        self._connection.write(contents)
+
+        status, discarded = self._read_status(response_size, len(contents))
+
+        if status is None:
+            self.resync(f"no valid response to \"{contents[:3].decode('utf-8')}\"", discarded)
+            raise ProtocolError(f"Lost response to command \"{contents[:3].decode('utf-8')}\"")
+
+        # Rejections never carry a payload, so there is nothing left to wait for.
+        if status == STATUS_REJECTED:
+            return status
+
+        payload = self._read(response_size - 2, self.timeout_for(response_size - 2))
+        if len(payload) != response_size - 2:
+            self.resync(f"truncated response to \"{contents[:3].decode('utf-8')}\"", discarded + len(payload) + 2)
+            raise ProtocolError(f"Truncated response to command \"{contents[:3].decode('utf-8')}\"")
+
+        # Stray bytes in front of the status indicator mean we were out of sync before this
+        # command. The response itself is fine, but later ones might not be.
+        if discarded > 0:
+            self._report(ResyncEvent("stray bytes before response", discarded, 0))
+
+        return status + payload
+
+    def resync(self, reason, discarded=0, report_clean=True):
+        """
+        Bring the link back in sync: drain all pending input and probe the on-chip debugger until
+        it answers cleanly. Commands cut short on the wire are completed by the probe bytes.
+
+        :param reason: Description of why resynchronization was necessary, used for reporting
+        :param discarded: Number of bytes already discarded by the caller
+        :param report_clean: Whether to report the resynchronization if the link turned out to be in sync already
+        """
+        discarded += self.drain()
+
+        for probe in range(1, self._max_probes + 1):
+            self._connection.write(PROBE_COMMAND)
+            response = self._read(PROBE_RESPONSE_SIZE, self.timeout_for(PROBE_RESPONSE_SIZE))
+
+            # Any additional bytes mean the probe did not arrive at an idle on-chip debugger
+            extra = self.drain()
+            if response in PROBE_RESPONSES and extra == 0:
+                if report_clean or discarded > 0 or probe > 1:
+                    self._report(ResyncEvent(reason, discarded, probe))
+                return
+
+            discarded += len(response) + extra
+
+        self._report(ResyncEvent(reason, discarded, self._max_probes))
+        raise DebuggerConnectionError(f"Failed to resynchronize with on-chip debugger ({reason})")
+
+    def drain(self):
+        """
+        Discard all pending input, including bytes still on the wire.
+        :return: Number of discarded bytes
+        """
+        discarded = 0
+        timeout = self.timeout_for(1)
+
+        while True:
+            data = self._read(max(self._connection.in_waiting, 1), timeout)
+            if not data:
+                return discarded
+            discarded += len(data)
+
+    def _read_status(self, response_size, sent):
+        """
+        Scan incoming data for a status indicator. At most response_size stray bytes are skipped.
+        :param response_size: The expected response size, in bytes
+        :param sent: Size of the command just sent. Its transmission time is added to the initial timeout.
+        :return: Tuple of status indicator (or None, if none was found) and number of skipped bytes
+        """
+        window = self._read(2, self.timeout_for(sent + 2))
+        discarded = 0
+
+        while len(window) == 2:
+            if window in (STATUS_ACCEPTED, STATUS_REJECTED):
+                return bytes(window), discarded
+
+            if discarded >= response_size:
+                break
+
+            # Slide window by a single byte
+            window = window[1:] + self._read(1, self.timeout_for(1))
+            discarded += 1
+
+        return None, discarded + len(window)
+
+    def _read(self, size, timeout):
+        """Read up to size bytes, waiting at most the given timeout"""
+        # Changing the timeout reconfigures the port, so only do it when necessary
+        if self._connection.timeout != timeout:
+            self._connection.timeout = timeout
+        return self._connection.read(size)
+
+    def _report(self, event):
+        """Record resynchronization event and pass it on to the registered handler, if any"""
+        self._resync_count += 1
+        if self.resync_handler is not None:
+            self.resync_handler(event)
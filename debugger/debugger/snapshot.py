@@ -0,0 +1,228 @@
+"""
+Module implementing a compressed, content-addressed store for memory snapshots taken via the
+on-chip debugger, and comparison of stored snapshots.
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+from collections import namedtuple
+from .errors import *
+
+
+# SRAM, as described in the memory map
+DEFAULT_REGIONS = [(0x3000, 0x1000)]
+
+
+SnapshotInfo = namedtuple('SnapshotInfo', ['name', 'fetched', 'sampled', 'stored'])
+SnapshotInfo.__doc__ = """Statistics about a saved snapshot: chunks fully read, chunks only sampled and chunks newly stored"""
+
+MemoryChange = namedtuple('MemoryChange', ['address', 'old', 'new', 'inferred'])
+MemoryChange.__doc__ = """A single memory word differing between two snapshots"""
+
+
+class SnapshotStore:
+    """
+    Stores memory snapshots on disk. Every memory region is split into fixed-size chunks, which are
+    stored compressed and named after the hash of their contents, so identical chunks are only stored once.
+
+    By default every chunk is read completely. Fast snapshots instead first check each chunk of a previous
+    snapshot with the same layout by reading a few sampled words, and only read chunks with differing samples
+    completely. Since unchanged samples don't guarantee an unchanged chunk, such chunks are marked as inferred.
+    The sampled words rotate with every snapshot, so repeated snapshots eventually cover every word.
+    """
+
+    def __init__(self, directory, chunk_size=256, samples=8):
+        """
+        Create new snapshot store.
+        :param directory: Directory to store snapshots in. Will be created if it doesn't exist.
+        :param chunk_size: Chunk size in bytes. Has to be a multiple of 4 bytes.
+        :param samples: Number of words sampled per chunk to detect changes
+        """
+        if chunk_size <= 0 or (chunk_size % 4) != 0:
+            raise SnapshotError("Snapshot chunk size has to be a positive multiple of 4 bytes")
+
+        self._directory = directory
+        self._chunk_directory = os.path.join(directory, 'chunks')
+        self._chunk_size = chunk_size
+        self._samples = max(1, min(samples, chunk_size // 4))
+
+        os.makedirs(self._chunk_directory, exist_ok=True)
+
+    def names(self):
+        """Retrieve the names of all stored snapshots, oldest first"""
+        manifests = [self.load(entry[:-5]) for entry in os.listdir(self._directory) if entry.endswith('.json')]
+        return [manifest['name'] for manifest in sorted(manifests, key=lambda manifest: manifest['created'])]
+
+    def latest(self):
+        """Retrieve the name of the most recently saved snapshot, or None if there is none"""
+        names = self.names()
+        return names[-1] if names else None
+
+    def load(self, name):
+        """Load the manifest of the snapshot with given name"""
+        try:
+            with open(self._manifest_path(name), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise SnapshotError(f"Snapshot \"{name}\" does not exist")
+
+    def save(self, interface, name, regions=None, base=None, fast=False):
+        """
+        Take a new snapshot of given memory regions and store it under given name.
+
+        :param interface: Connected debugger interface. The CPU has to be halted.
+        :param name: Name of the new snapshot
+        :param regions: List of (start address, length) tuples. Defaults to the SRAM.
+        :param base: Name of snapshot to detect changes against. Defaults to the most recent snapshot.
+        :param fast: Only sample chunks of the base snapshot and carry them over if the samples match.
+        The resulting snapshot might not reflect all changes to memory.
+        :return: SnapshotInfo describing the work done
+        """
+        if regions is None:
+            regions = DEFAULT_REGIONS
+
+        for start, length in regions:
+            if (start % 4) != 0 or length <= 0 or (length % 4) != 0:
+                raise MemoryAddressError("Snapshot regions have to be word-aligned and not empty")
+
+        if base is None:
+            base = self.latest()
+        previous = self.load(base) if base is not None else None
+
+        # Sampling only makes sense if the layout didn't change
+        if previous is not None and (previous['chunk_size'] != self._chunk_size or
+                                     [region[:2] for region in previous['regions']] != [list(r) for r in regions]):
+            previous = None
+
+        generation = previous['generation'] + 1 if previous is not None else 0
+        fetched, sampled, stored = 0, 0, 0
+        manifest_regions = []
+
+        for index, (start, length) in enumerate(regions):
+            chunks, inferred = [], []
+
+            for offset in range(0, length, self._chunk_size):
+                address = start + offset
+                size = min(self._chunk_size, length - offset)
+
+                if fast and previous is not None:
+                    old_digest = previous['regions'][index][2][len(chunks)]
+                    if self._samples_match(interface, address, self.read_chunk(old_digest), generation):
+                        chunks.append(old_digest)
+                        inferred.append(len(chunks) - 1)
+                        sampled += 1
+                        continue
+
+                data = interface.read_memory_raw(address, size)
+                fetched += 1
+
+                digest, is_new = self._store_chunk(data)
+                chunks.append(digest)
+                stored += is_new
+
+            manifest_regions.append([start, length, chunks, inferred])
+
+        manifest = {
+            'name': name,
+            'created': time.time(),
+            'generation': generation,
+            'chunk_size': self._chunk_size,
+            'regions': manifest_regions
+        }
+        self._write_manifest(name, manifest)
+
+        return SnapshotInfo(name, fetched, sampled, stored)
+
+    def diff(self, first, second):
+        """
+        Compare two snapshots word by word. Only regions present in both snapshots are compared.
+
+        :param first: Name of the older snapshot
+        :param second: Name of the newer snapshot
+        :return: List of MemoryChange entries, ordered by address
+        """
+        old, new = self.load(first), self.load(second)
+        old_regions = {(start, length): (chunks, set(inferred)) for start, length, chunks, inferred in old['regions']}
+        changes = []
+
+        for start, length, chunks, inferred in new['regions']:
+            if (start, length) not in old_regions or old['chunk_size'] != new['chunk_size']:
+                continue
+
+            old_chunks, old_inferred = old_regions[(start, length)]
+            for index, (old_digest, new_digest) in enumerate(zip(old_chunks, chunks)):
+                # Content-addressed chunks: equal digests mean equal contents
+                if old_digest == new_digest:
+                    continue
+
+                old_data, new_data = self.read_chunk(old_digest), self.read_chunk(new_digest)
+                is_inferred = index in old_inferred or index in inferred
+                address = start + index * new['chunk_size']
+
+                for offset in range(0, len(new_data), 4):
+                    if old_data[offset:offset+4] != new_data[offset:offset+4]:
+                        changes.append(MemoryChange(address + offset,
+                                                    int.from_bytes(old_data[offset:offset+4], 'little'),
+                                                    int.from_bytes(new_data[offset:offset+4], 'little'),
+                                                    is_inferred))
+
+        return changes
+
+    def read_chunk(self, digest):
+        """Load and decompress the chunk with given digest"""
+        with open(os.path.join(self._chunk_directory, digest), 'rb') as file:
+            return zlib.decompress(file.read())
+
+    def _samples_match(self, interface, address, data, generation):
+        """Check whether the sampled words of a chunk still match its previously stored contents"""
+        words = len(data) // 4
+        samples = min(self._samples, words)
+        stride = words // samples
+
+        # Rotate the sampled words with every generation
+        phase = generation % stride
+
+        for sample in range(samples):
+            offset = (sample * stride + phase) * 4
+            if interface.read_memory(address + offset) != int.from_bytes(data[offset:offset+4], 'little'):
+                return False
+
+        return True
+
+    def _store_chunk(self, data):
+        """
+        Store given chunk, unless it is already present.
+        :return: Tuple of chunk digest and whether the chunk had to be written
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        path = os.path.join(self._chunk_directory, digest)
+
+        if os.path.exists(path):
+            return digest, False
+
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(zlib.compress(bytes(data)))
+        os.replace(temporary_path, path)
+
+        return digest, True
+
+    def _write_manifest(self, name, manifest):
+        """Atomically write manifest of snapshot with given name"""
+        path = self._manifest_path(name)
+        temporary_path = f"{path}.tmp"
+
+        with open(temporary_path, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, path)
+
+    def _manifest_path(self, name):
+        """Determine path of the manifest of snapshot with given name"""
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', name) or name.startswith('.'):
+            raise SnapshotError(f"Invalid snapshot name \"{name}\"")
+
+        return os.path.join(self._directory, f"{name}.json")
@@ -6,43 +6,75 @@ from functools import wraps
 from debugger import DebuggerError
 
 
-def debugger_command(usage, argument_count):
+def debugger_command(usage, argument_count, optional_count=0):
     """
     A decorator for shell command handlers that automatically handles argument splitting
     and error handling in case of the user passing an invalid number of arguments.
     It also catches any errors originating from the debugger interface layer, to simplify
     shell code.
 
+    This has to be the outermost decorator. All state checks added by exclude_state and require_state
+    below it are combined with the argument validation into a single wrapper, which is built only once.
+
     :param usage: A usage example string to be shown to the user in case of wrong argument count
     :param argument_count: Amount of expected arguments to this command
+    :param optional_count: Amount of additional, optional arguments this command accepts. None allows any amount.
     :return: Decorator with given parameters
     """
 
+    # The message shown on wrong argument count only depends on the decorator parameters
+    if argument_count == 0 and optional_count == 0:
+        count_message = f"Command '{usage}' expects no arguments"
+    elif optional_count is None:
+        count_message = f"Command expected at least {argument_count} argument{'s' if argument_count > 1 else ''}\n{usage}"
+    elif optional_count > 0:
+        count_message = f"Command expected between {argument_count} and {argument_count + optional_count} arguments\n{usage}"
+    else:
+        count_message = f"Command expected exactly {argument_count} argument{'s' if argument_count > 1 else ''}\n{usage}"
+
+    max_count = argument_count + optional_count if optional_count is not None else float('inf')
+
     # Actual decorator
     def decorator(func):
+        state_checks = tuple(getattr(func, 'state_checks', ()))
+
         @wraps(func)
         def with_args(shell, args):
-            arguments = args.split()
-            if len(arguments) != argument_count:
-                # Special case for zero expected arguments
-                if argument_count == 0:
-                    print(f"Command '{usage}' expects no arguments")
-                else:
-                    print(f"Command expected exactly {argument_count} argument{'s' if argument_count > 1 else ''}")
-                    print(usage)
-            else:
-                try:
-                    func(shell, arguments)
-                except DebuggerError as error:
-                    print(f"Failed to execute operation: {str(error)}")
+            # Handlers calling each other pass on already split arguments
+            arguments = args.split() if isinstance(args, str) else args
+            if not (argument_count <= len(arguments) <= max_count):
+                print(count_message)
+                return
+
+            if state_checks:
+                state = shell.state()
+                for expected, matches, message in state_checks:
+                    if (state == expected) != matches:
+                        print(message)
+                        return
+
+            try:
+                func(shell, arguments)
+            except DebuggerError as error:
+                print(f"Failed to execute operation: {str(error)}")
         return with_args
     return decorator
 
 
+def _add_state_check(func, expected, matches, message):
+    """
+    Register a state check with given command handler. Checks are stored in the order the decorators
+    appear in the source, which is the reverse of the order they are applied in.
+    """
+    func.state_checks = [(expected, matches, message)] + getattr(func, 'state_checks', [])
+    return func
+
+
 def exclude_state(excluded_state, message):
     """
     A decorator for shell command handlers that causes the command to fail if the debugger
     is in given state, displaying the given message to the user.
+    Has to be used below debugger_command, which performs the actual check.
 
     :param excluded_state: State to exclude
     :param message: Message to display on failure
@@ -50,13 +82,7 @@ def exclude_state(excluded_state, message):
     """
 
     def decorator(func):
-        @wraps(func)
-        def wrapped(shell, args):
-            if shell.state() == excluded_state:
-                print(message)
-            else:
-                func(shell, args)
-        return wrapped
+        return _add_state_check(func, excluded_state, False, message)
     return decorator
 
 
@@ -64,6 +90,7 @@ def require_state(required_state, message):
     """
     Decorator for shell command handlers that adds a check for the debugger to be in given state.
     Will show given error message to the user in case of failure.
+    Has to be used below debugger_command, which performs the actual check.
 
     :param required_state: State to require
     :param message: Message to display on failure
@@ -71,12 +98,5 @@ def require_state(required_state, message):
     """
 
     def decorator(func):
-        @wraps(func)
-        def wrapped(shell, args):
-            if shell.state() != required_state:
-                print(message)
-            else:
-                func(shell, args)
-        return wrapped
+        return _add_state_check(func, required_state, True, message)
     return decorator
-
@@ -9,6 +9,9 @@ if __name__ == "__main__":
         description="Interactive RISC-V debugger"
     )
     parser.add_argument('--port', type=str, help='serial port to use. Will cause the debugger to connect on startup.')
+    parser.add_argument('--fleet', type=str, nargs='+', metavar='PORT', help='serial ports of boards to add to the fleet on startup.')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY * 1000,
+                        help='latency of the serial adapter in milliseconds, added to all response timeouts.')
     args = parser.parse_args()
-    sys.exit(Shell(port=args.port).cmdloop())
+    sys.exit(Shell(port=args.port, fleet_ports=args.fleet, latency=args.latency / 1000).cmdloop())
 
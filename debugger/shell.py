@@ -3,6 +3,8 @@ import sys
 import pathlib
 import os.path
 import readline
+import threading
+import time
 from debugger import *
 from decorators import *
 
@@ -10,22 +12,33 @@ from decorators import *
 history_file = os.path.expanduser('~/.local/share/rvdbg/.history')
 history_file_size = 1024
 
+# Memory snapshot storage
+snapshot_directory = os.path.expanduser('~/.local/share/rvdbg/snapshots')
+
 
 class Shell(cmd2.Cmd):
     """Main debugger shell implementation"""
 
-    _interface = DebuggerInterface()
     _no_shortcut = {'help', 'hide_responses', 'history', 'run_script', 'run_pyscript',
                     'shell', 'set', 'shortcuts', 'show_responses', 'read_memory', 'step_location',
-                    'write_memory', 'edit', 'sl', 'eof', 'clear_breakpoint', 'quit'}
+                    'write_memory', 'edit', 'sl', 'eof', 'clear_breakpoint', 'quit',
+                    'continue', 'run_until', 'snapshot', 'fleet', 'verify_firmware'}
+    _table_modifying_commands = {'alias', 'macro', 'py', 'run_pyscript'}
     prompt = 'DISCONNECTED> '
 
-    def __init__(self, port=None):
+    def __init__(self, port=None, fleet_ports=None, latency=DEFAULT_LATENCY):
         """
         Initialize new debugger shell object.
         :param port: Optional serial port, which causes the debugger to immediately try to connect to the on-chip
         debugger using that port.
+        :param fleet_ports: Optional list of serial ports of boards to add to the fleet on startup.
+        :param latency: Delay, in seconds, the serial adapters add to responses.
         """
+        self._latency = latency
+        self._interface = DebuggerInterface()
+        self._fleet = Fleet()
+        self._command_table = None
+        self._timings = {}
 
         super(Shell, self).__init__(
             persistent_history_file=history_file,
@@ -39,6 +52,9 @@ class Shell(cmd2.Cmd):
         if port is not None:
             self.runcmds_plus_hooks([f"c {port}"])
 
+        if fleet_ports:
+            self.runcmds_plus_hooks([f"fleet connect {' '.join(fleet_ports)}"])
+
     def update_prompt(self):
         """Update the current prompt according to the debugger state"""
         if self.state() == DebuggerState.DISCONNECTED:
@@ -51,29 +67,52 @@ class Shell(cmd2.Cmd):
         if self.state() != DebuggerState.DISCONNECTED:
             self._interface.disconnect()
 
+        if self._fleet.ports:
+            self._fleet.disconnect()
+
         return True
 
+    def command_table(self):
+        """
+        Retrieve the set of directly matching identifiers and the prefix table used to complete incomplete commands.
+        Both are only rebuilt after commands, macros or aliases might have changed.
+        """
+        if self._command_table is None:
+            commands = self.get_all_commands()
+            direct_matches = set(commands) | set(self.macros) | set(self.aliases)
+
+            # Map every prefix of every command to the command it completes to. Prefixes shared
+            # by multiple commands are ambiguous and map to None.
+            prefixes = {}
+            for command in commands:
+                if command in self._no_shortcut:
+                    continue
+
+                for length in range(1, len(command) + 1):
+                    prefix = command[:length]
+                    prefixes[prefix] = command if prefix not in prefixes else None
+
+            self._command_table = (direct_matches, prefixes)
+
+        return self._command_table
+
     def precmd(self, statement: cmd2.Statement) -> cmd2.Statement:
         """Try to complete entered, incomplete commands based on best-fit"""
         identifier = statement.command
-
-        # Check if entered command is a direct fit. If so, we do not do anything here.
-        is_direct_match = (identifier in self.get_all_commands())\
-                          or (identifier in self.macros)\
-                          or (identifier in self.aliases)
+        direct_matches, prefixes = self.command_table()
 
         # Continue of the given command is direct match
-        if is_direct_match:
+        if identifier in direct_matches:
             return statement
 
         # Otherwise, it clearly is not a registered command, macro or alias
-        # We now try to find all commands that have the given input as a prefix.
+        # We now look up the command that has the given input as a prefix.
         # We disregard macros and aliases, and we only auto-complete if there is no ambiguity.
-        matching_commands = [cmd for cmd in self.get_all_commands() if cmd.startswith(identifier) and cmd not in self._no_shortcut]
-        if len(matching_commands) == 1:
+        command = prefixes.get(identifier)
+        if command is not None:
             return cmd2.Statement(statement.args,
                               raw=statement.raw,
-                              command=matching_commands[0],
+                              command=command,
                               arg_list=statement.arg_list,
                               multiline_command=statement.multiline_command,
                               terminator=statement.terminator,
@@ -84,6 +123,70 @@ class Shell(cmd2.Cmd):
         else:
             return statement
 
+    def onecmd(self, statement, **kwargs) -> bool:
+        """Execute a single command, recording its execution time even if it fails"""
+        start = time.perf_counter()
+        try:
+            return super(Shell, self).onecmd(statement, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            if not isinstance(statement, cmd2.Statement):
+                statement = self.statement_parser.parse(statement)
+            command = statement.command
+
+            # Only known identifiers get an entry, typos don't
+            if command in self.command_table()[0]:
+                count, total, maximum = self._timings.get(command, (0, 0.0, 0.0))
+                self._timings[command] = (count + 1, total + elapsed, max(maximum, elapsed))
+
+            if command in self._table_modifying_commands:
+                self._command_table = None
+
+    def report_resync(self, event):
+        """Inform the user about the serial link having been resynchronized"""
+        print(f"Serial link resynchronized ({event.reason}): discarded {event.discarded} byte(s), "
+              f"{event.probes} probe(s)")
+
+    def wait_for_halt(self, timeout=None):
+        """
+        Wait for the CPU to halt and show the new location. Polling is done in a background thread, so
+        the user can stop waiting using Ctrl-C without interrupting a transfer on the serial link.
+        :param timeout: Maximum time to wait, in seconds. Wait forever if None.
+        """
+        cancel = threading.Event()
+        result = {}
+
+        def poll():
+            try:
+                result['halted'] = self._interface.wait_for_halt(timeout, cancel)
+            except DebuggerError as error:
+                result['error'] = error
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+
+        # The polling thread has to be finished before returning, since it uses the serial link.
+        # Further Ctrl-C presses while it winds down are ignored.
+        while thread.is_alive():
+            try:
+                thread.join(0.1)
+            except KeyboardInterrupt:
+                cancel.set()
+
+        self.update_prompt()
+
+        if 'error' in result:
+            raise result['error']
+
+        if result.get('halted'):
+            print("CPU halted")
+            self.do_location('')
+        elif cancel.is_set():
+            print("Stopped waiting, CPU is still running")
+        else:
+            print("Timed out waiting, CPU is still running")
+
     def state(self):
         """Retrieve current debugger interface state"""
         return self._interface.state
@@ -137,13 +240,28 @@ class Shell(cmd2.Cmd):
         value = int(args[1], 0)
         self._interface.write_memory(address, value)
 
-    @debugger_command("read_memory [address]", argument_count=1)
+    @debugger_command("read_memory [address] [type] [count]", argument_count=1, optional_count=2)
     @exclude_state(DebuggerState.DISCONNECTED, "Debugger is disconnected")
     @require_state(DebuggerState.HALTED, "Can't perform memory read on running CPU. Halt execution first.")
     def do_read_memory(self, args):
+        """Read values of given type (word, half_word, byte or their signed_ variants) from memory"""
         address = int(args[0], 0)
-        result = self._interface.read_memory(address)
-        print(f"Memory read result: 0x{format(result, '08x')}")
+
+        try:
+            data_type = DataType[args[1].upper()] if len(args) > 1 else DataType.WORD
+        except KeyError:
+            print(f"Unknown data type '{args[1]}'. Valid types: {', '.join(t.name.lower() for t in DataType)}")
+            return
+
+        count = int(args[2], 0) if len(args) > 2 else 1
+
+        # Keep the short output for the simple, single word case
+        if count == 1 and data_type == DataType.WORD:
+            result = self._interface.read_memory(address)
+            print(f"Memory read result: 0x{format(result, '08x')}")
+        else:
+            values = self._interface.read_memory_typed(address, count, data_type)
+            print(format_memory_dump(address, values, data_type))
 
     @debugger_command("show_responses", argument_count=0)
     def do_show_responses(self, arg):
@@ -172,7 +290,11 @@ class Shell(cmd2.Cmd):
     @require_state(DebuggerState.DISCONNECTED, "Can't connect: Already connected")
     def do_connect(self, args):
         """Connect to SoC using the given serial port"""
-        self._interface.connect(args[0])
+        if args[0] in self._fleet.ports:
+            print(f"Can't connect: Port {args[0]} is already in use by the fleet")
+            return
+
+        self._interface.connect(args[0], latency=self._latency, resync_handler=self.report_resync)
         self.update_prompt()
 
     @debugger_command("pc", argument_count=0)
@@ -213,3 +335,161 @@ class Shell(cmd2.Cmd):
         # refresh the state
         self._interface.refresh_state()
         self.update_prompt()
+
+    @debugger_command("continue [timeout]", argument_count=0, optional_count=1)
+    @exclude_state(DebuggerState.DISCONNECTED, "Debugger is disconnected")
+    def do_continue(self, args):
+        """Resume execution, if halted, and wait for the CPU to hit the breakpoint. Stop waiting with Ctrl-C."""
+        timeout = float(args[0]) if args else None
+
+        # The CPU might have halted on its own since the state was last queried
+        self._interface.refresh_state()
+        if self.state() == DebuggerState.HALTED:
+            self._interface.resume()
+
+        self.wait_for_halt(timeout)
+
+    @debugger_command("run_until [address] [timeout]", argument_count=1, optional_count=1)
+    @exclude_state(DebuggerState.DISCONNECTED, "Debugger is disconnected")
+    def do_run_until(self, args):
+        """Run until given flash address is reached. The current hardware breakpoint is restored afterwards."""
+        address = int(args[0], 0)
+        timeout = float(args[1]) if len(args) > 1 else None
+        previous_breakpoint = self._interface.breakpoint
+
+        self._interface.set_breakpoint(address)
+
+        try:
+            # The CPU might have halted on its own since the state was last queried
+            self._interface.refresh_state()
+            if self.state() == DebuggerState.HALTED:
+                self._interface.resume()
+
+            self.wait_for_halt(timeout)
+        finally:
+            # The breakpoint was only temporary
+            if previous_breakpoint is not None:
+                self._interface.set_breakpoint(previous_breakpoint)
+            else:
+                self._interface.clear_breakpoint()
+
+    @debugger_command("snapshot save [--fast] [name] [start-end ...] | snapshot diff [name] [name] | snapshot list",
+                      argument_count=1, optional_count=None)
+    def do_snapshot(self, args):
+        """Save SRAM and optional further memory ranges as named snapshot, or compare two snapshots"""
+        store = SnapshotStore(snapshot_directory)
+
+        if args[0] == 'list' and len(args) == 1:
+            for name in store.names():
+                print(name)
+
+        elif args[0] == 'save' and len(args) >= 2:
+            if self.state() != DebuggerState.HALTED:
+                print("Can't take snapshot of running CPU. Halt execution first.")
+                return
+
+            fast = args[1] == '--fast'
+            arguments = args[2:] if fast else args[1:]
+            if not arguments:
+                print("snapshot save [--fast] [name] [start-end ...]")
+                return
+
+            # Additional ranges are given inclusively, like in the memory map
+            regions = list(DEFAULT_REGIONS)
+            for memory_range in arguments[1:]:
+                start, end = (int(address, 0) for address in memory_range.split('-'))
+                regions.append((start, end - start + 1))
+
+            info = store.save(self._interface, arguments[0], regions, fast=fast)
+            print(f"Saved snapshot \"{info.name}\": {info.fetched} chunk(s) read, {info.sampled} chunk(s) sampled, "
+                  f"{info.stored} chunk(s) stored")
+
+        elif args[0] == 'diff' and len(args) == 3:
+            changes = store.diff(args[1], args[2])
+            for change in changes:
+                print(f"0x{format(change.address, '08x')}: 0x{format(change.old, '08x')} -> "
+                      f"0x{format(change.new, '08x')}{' *' if change.inferred else ''}")
+
+            print(f"{len(changes)} word(s) differ")
+            if any(change.inferred for change in changes):
+                print("* Part of a chunk that was only sampled, the change might have happened earlier")
+
+            # Both snapshots might carry over chunks that were only sampled
+            for name in args[1:3]:
+                sampled = sum(len(region[3]) for region in store.load(name)['regions'])
+                if sampled > 0:
+                    print(f"{sampled} chunk(s) of \"{name}\" were only sampled and might hide further changes")
+
+        else:
+            print("snapshot save [--fast] [name] [start-end ...] | snapshot diff [name] [name] | snapshot list")
+
+    @debugger_command("verify_firmware [file]", argument_count=1)
+    @exclude_state(DebuggerState.DISCONNECTED, "Debugger is disconnected")
+    @require_state(DebuggerState.HALTED, "Can't read flash of running CPU. Halt execution first.")
+    def do_verify_firmware(self, args):
+        """Compare the flash contents with given raw firmware image (flash.bin)"""
+        with open(args[0], 'rb') as file:
+            image = file.read()
+
+        mismatches = self._interface.verify_firmware(image)
+        if mismatches:
+            print(f"Flash differs from firmware image in {len(mismatches)} word(s), first at 0x{format(mismatches[0], '08x')}")
+        else:
+            print("Flash matches firmware image")
+
+    @debugger_command("fleet connect [port ...] | fleet [halt|resume|state|disconnect] | "
+                      "fleet read [address] [type] [count] | fleet write [address] [value] | fleet verify [file]",
+                      argument_count=1, optional_count=None)
+    def do_fleet(self, args):
+        """Perform operations on all boards of the fleet in parallel"""
+        operation = args[0]
+
+        if operation == 'connect' and len(args) >= 2:
+            busy_ports = [self._interface.port] if self.state() != DebuggerState.DISCONNECTED else []
+            results = self._fleet.connect(args[1:], busy_ports=busy_ports, latency=self._latency)
+        elif operation in ('halt', 'resume', 'disconnect') and len(args) == 1:
+            results = getattr(self._fleet, operation)()
+        elif operation == 'state' and len(args) == 1:
+            results = self._fleet.refresh_state()
+        elif operation == 'read' and 2 <= len(args) <= 4:
+            try:
+                data_type = DataType[args[2].upper()] if len(args) > 2 else DataType.WORD
+            except KeyError:
+                print(f"Unknown data type '{args[2]}'. Valid types: {', '.join(t.name.lower() for t in DataType)}")
+                return
+
+            address = int(args[1], 0)
+            count = int(args[3], 0) if len(args) > 3 else 1
+            results = self._fleet.read_memory(address, count, data_type)
+        elif operation == 'write' and len(args) == 3:
+            results = self._fleet.write_memory(int(args[1], 0), int(args[2], 0))
+        elif operation == 'verify' and len(args) == 2:
+            with open(args[1], 'rb') as file:
+                results = self._fleet.verify_firmware(file.read())
+        else:
+            print("fleet connect [port ...] | fleet [halt|resume|state|disconnect] | "
+                  "fleet read [address] [type] [count] | fleet write [address] [value] | fleet verify [file]")
+            return
+
+        for port, result in results.items():
+            if result.error is not None:
+                print(f"{port}: Failed: {str(result.error)}")
+            elif operation == 'state':
+                print(f"{port}: {result.value.name}")
+            elif operation == 'read':
+                print(f"{port}:\n{format_memory_dump(address, result.value, data_type)}")
+            elif operation == 'verify':
+                print(f"{port}: {'Flash matches firmware image' if not result.value else f'{len(result.value)} word(s) differ'}")
+            else:
+                print(f"{port}: OK")
+
+    @debugger_command("timings [reset]", argument_count=0, optional_count=1)
+    def do_timings(self, args):
+        """Show how much time was spent in each command, or reset the recorded timings"""
+        if args and args[0] == 'reset':
+            self._timings = {}
+            return
+
+        print(f"{'command':<20} {'count':>8} {'total ms':>10} {'avg ms':>10} {'max ms':>10}")
+        for command, (count, total, maximum) in sorted(self._timings.items(), key=lambda entry: -entry[1][1]):
+            print(f"{command:<20} {count:>8} {total*1000:>10.2f} {total/count*1000:>10.2f} {maximum*1000:>10.2f}")